@@ -4,13 +4,19 @@
 
 from matplotlib import pyplot as plt
 
-from scipy import signal
+from scipy.ndimage import convolve1d
+from scipy.signal import savgol_coeffs
 from snowmicropyn import Profile
 
 p = Profile.load('profiles/S37M0876.pnt')
 
+# Savitzky-Golay filter of 2nd order over 1211 samples. The coefficients are
+# calculated once and can be reused to smooth further profiles. To smooth many
+# profiles at once, stack them into a 2-D array and pass axis=1.
+coeffs = savgol_coeffs(242 * 5 + 1, 2)
+
 x, y = p.samples.distance, p.samples.force
-y_smoothed = signal.savgol_filter(y, 242*5+1, 2)
+y_smoothed = convolve1d(y.values, coeffs, mode='mirror')
 
 plt.plot(x, y)
 plt.plot(x, y_smoothed, 'r')
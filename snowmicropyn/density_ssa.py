@@ -11,6 +11,7 @@ Issue 2, February 2015.
 
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import warnings
@@ -21,54 +22,93 @@ import snowmicropyn.profile as profile
 
 DENSITY_ICE = 917.
 
+# Regression coefficients of the supported models, selectable by name
+_MODEL_COEFFS = {
+    # Proksch et al. (2015), eqn 9 and 11
+    'P2015': {'density': [420.47, 102.47, -121.15, -169.96], 'ssa': [0.131, 0.355, 0.0291], 'equation': 'l_ex'},
+    # Calonne et al. 2020 https://doi.org/10.5194/tc-14-1829-2020
+    'C2020': {'density': [295.8, 65.1, -43.2, 47.1], 'ssa': [0.57, -18.56, -3.66], 'equation': 'ssa'},
+    # King et al. 2020 https://doi.org/10.5194/tc-14-4323-2020 Table 2
+    'K2020a': {'density': [315.61, 46.94, -43.94, -88.15], 'ssa': [np.nan, np.nan, np.nan], 'equation': 'ssa'},
+    # King et al. 2020 https://doi.org/10.5194/tc-14-4323-2020 Table 2
+    'K2020b': {'density': [312.54, 50.27, -50.26, -85.35], 'ssa': [np.nan, np.nan, np.nan], 'equation': 'ssa'},
+}
 
-def calc_step(median_force, element_size, coeff_model):
-    """Calculation of density and ssa from median of force and element size.
 
-    This is the actual math described in the publication.
+def _resolve_coeffs(coeff_model):
+    """Get the coefficients dict for a model name, or pass a dict through.
 
-    :param median_force: Median of force.
-    :param element_size: Element size.
-    :return: Tuple containing density and ssa value.
+    Proksch et al. (2015) coefficients are used if coeff_model is None.
     """
-    l = element_size
-    fm = median_force
-
-    # Specify log_l = False to use Proksch form of SSA regression equation or log_l = True to use Calonne version
-
     if coeff_model is None:
-        # Use Proksch et al. (2015) coefficients if not specified (eqn 9 and 11)
-        coeffs = {'density':[420.47, 102.47, -121.15, -169.96], 'ssa':[0.131, 0.355, 0.0291], 'equation':'l_ex'}
-    elif coeff_model == 'P2015':
-        # Proksch et al. (2015)
-        coeffs = {'density':[420.47, 102.47, -121.15, -169.96], 'ssa':[0.131, 0.355, 0.0291], 'equation':'l_ex'}
-    elif coeff_model == 'C2020':
-        # Calonne et al. 2020 https://doi.org/10.5194/tc-14-1829-2020
-        coeffs = {'density': [295.8, 65.1, -43.2, 47.1], 'ssa':[0.57, -18.56, -3.66], 'equation':'ssa'}
-    elif coeff_model == 'K2020a':
-        # King et al. 2020 https://doi.org/10.5194/tc-14-4323-2020 Table 2
-        coeffs = {'density':[315.61, 46.94, -43.94, -88.15], 'ssa':[np.nan, np.nan, np.nan], 'equation':'ssa'}
-    elif coeff_model == 'K2020b':
-        # King et al. 2020 https://doi.org/10.5194/tc-14-4323-2020 Table 2
-        coeffs = {'density': [312.54, 50.27, -50.26, -85.35], 'ssa':[np.nan, np.nan, np.nan], 'equation':'ssa'}
-    else:
-        coeffs = coeff_model
+        return _MODEL_COEFFS['P2015']
+    if isinstance(coeff_model, str):
+        try:
+            return _MODEL_COEFFS[coeff_model]
+        except KeyError:
+            raise ValueError('coeff_model {} unknown, must be one of {}'.format(
+                repr(coeff_model), ', '.join(_MODEL_COEFFS))) from None
+    return coeff_model
+
+
+def _make_step(coeffs):
+    """Create a function calculating density and ssa from median of force and
+    element size, with the coefficients and the form of the ssa equation
+    resolved up front.
+
+    :param coeffs: dict of coefficients with keys 'density', 'ssa' and
+           'equation', see :func:`calc_step`.
+    :return: Function taking median force and element size and returning a
+             tuple containing density and ssa value(s).
+    """
+    d0, d1, d2, d3 = coeffs['density']
+    s0, s1, s2 = coeffs['ssa']
 
-    density = coeffs['density'][0] + coeffs['density'][1] * np.log(fm) + coeffs['density'][2] * np.log(fm) * l + coeffs['density'][3] * l
+    def density_of(log_fm, l):
+        # Factored form of a1 + a2 * log(fm) + a3 * log(fm) * l + a4 * l
+        return d0 + d3 * l + log_fm * (d1 + d2 * l)
 
     if coeffs['equation'] == 'ssa':
         # Use Calonne version
-        ssa = coeffs['ssa'][0] + coeffs['ssa'][1] * np.log(l) + coeffs['ssa'][2] * np.log(fm)
+        def step(fm, l):
+            log_fm = np.log(fm)
+            density = density_of(log_fm, l)
+            ssa = s0 + s1 * np.log(l) + s2 * log_fm
+            return density, ssa
     elif coeffs['equation'] == 'l_ex':
         # Use Proksch version
-        lc = coeffs['ssa'][0] + coeffs['ssa'][1] * l + coeffs['ssa'][2] * np.log(fm)
-        # Equation 12 in publication
-        ssa = 4 * (1 - (density / DENSITY_ICE)) / lc
+        def step(fm, l):
+            log_fm = np.log(fm)
+            density = density_of(log_fm, l)
+            lc = s0 + s1 * l + s2 * log_fm
+            # Equation 12 in publication
+            ssa = 4 * (1 - (density / DENSITY_ICE)) / lc
+            return density, ssa
     else:
         warnings.warn('ssa equation form is not recognized. Expecting "l_ex" or "ssa"')
-        ssa = np.nan
 
-    return density, ssa
+        def step(fm, l):
+            density = density_of(np.log(fm), l)
+            return density, np.nan if np.ndim(density) == 0 else np.full_like(density, np.nan)
+
+    return step
+
+
+def calc_step(median_force, element_size, coeffs):
+    """Calculation of density and ssa from median of force and element size.
+
+    This is the actual math described in the publication. Works on scalars as
+    well as on numpy arrays, in which case all windows are calculated at once.
+
+    :param median_force: Median of force (scalar or numpy array).
+    :param element_size: Element size (scalar or numpy array).
+    :param coeffs: Model name ('P2015', 'C2020', 'K2020a' or 'K2020b'), None
+           for Proksch et al. (2015) or dict of coefficients with keys
+           'density', 'ssa' and 'equation' ('l_ex' for Proksch or 'ssa' for
+           Calonne form of SSA regression equation).
+    :return: Tuple containing density and ssa value(s).
+    """
+    return _make_step(_resolve_coeffs(coeffs))(median_force, element_size)
 
 
 def calc(samples, coeff_model=None, window=snowmicropyn.windowing.DEFAULT_WINDOW, overlap=snowmicropyn.windowing.DEFAULT_WINDOW_OVERLAP):
@@ -76,7 +116,7 @@ def calc(samples, coeff_model=None, window=snowmicropyn.windowing.DEFAULT_WINDOW
     of a SnowMicroPen recording.
 
     :param samples: A pandas dataframe containing the columns 'distance' and 'force' or list of profiles containing these (will find median)
-    :param coeffs [Optional]: dict of coefficients for calculating density and ssa. Defaults to Proksch et al. (2015)
+    :param coeff_model [Optional]: Model name ('P2015', 'C2020', 'K2020a' or 'K2020b') or dict of coefficients for calculating density and ssa. Defaults to Proksch et al. (2015)
     :param window: Size of window in millimeters.
     :param overlap: Overlap factor in percent.
     :return: A pandas dataframe with the columns 'distance', 'density' and 'ssa'.
@@ -98,19 +138,38 @@ def calc(samples, coeff_model=None, window=snowmicropyn.windowing.DEFAULT_WINDOW
         # Use defaults for Proksch 2015
         pass
 
+    coeffs = _resolve_coeffs(coeff_model)
+
     if isinstance(samples, list):
         sn = median_profile(samples, window, overlap)
     else:
-        # Apply filtering to remove -ve force and linearly interpolate
-        samples.loc[samples['force'] < 0, 'force'] = np.nan
-        samples.force.interpolate(method='linear', inplace=True)
+        # Apply filtering to remove -ve force and linearly interpolate. Caller's
+        # dataframe is left untouched.
+        force = samples['force'].to_numpy()
+        bad = ~(force >= 0)  # Negative or NaN
+        if bad.any():
+            force = np.where(bad, np.nan, force)
+            good = ~bad
+            if good.any():
+                idx = np.arange(force.size)
+                force[bad] = np.interp(idx[bad], idx[good], force[good])
+            samples = samples.assign(force=force)
         sn = snowmicropyn.loewe2012.calc(samples, window, overlap)
 
-    result = []
-    for index, row in sn.iterrows():
-        density, ssa = calc_step(row.force_median, row.L2012_L, coeff_model)
-        result.append((row.distance, density, ssa))
-    return pd.DataFrame(result, columns=['distance', 'density', 'ssa'])
+    # Calculate all windows in one go
+    density, ssa = _make_step(coeffs)(sn.force_median.to_numpy(), sn.L2012_L.to_numpy())
+    return pd.DataFrame({'distance': sn.distance.to_numpy(), 'density': density, 'ssa': ssa},
+                        columns=['distance', 'density', 'ssa'], copy=False)
+
+
+def _cropped_loewe2012(pr, surface, nlayers, window, overlap):
+    """Crop a profile to nlayers samples below surface and calculate the shot
+    noise model parameters for it."""
+    # Crop to surface NB original distance retained i.e. doesn't start at zero but think this is ok
+    # Distance is sorted, so first sample below surface can be found by binary search
+    start = np.searchsorted(pr.samples.distance.values, surface, side='right')
+    cropped_samples = pr.samples.iloc[start:start + nlayers]
+    return snowmicropyn.loewe2012.calc(cropped_samples, window, overlap)
 
 
 def median_profile(list_of_filenames, window, overlap):
@@ -129,36 +188,40 @@ def median_profile(list_of_filenames, window, overlap):
         
     '''    
     
+    # Load each profile and detect its surface and ground only once
+    profiles = []
+    for p in list_of_filenames:
+        pr = profile.Profile(p)
+        profiles.append((p, pr, pr.detect_surface(), pr.detect_ground()))
+
     # Find shortest profile
-    shortest_length = min([(profile.Profile(p).detect_ground() - profile.Profile(p).detect_surface()) for p in list_of_filenames])
+    shortest_length = min([(ground - surface) for _, _, surface, ground in profiles])
     # Get depth resolution of samples
-    depth_step = profile.Profile(list_of_filenames[0]).samples.distance.diff().iloc[-1]
+    depth_step = profiles[0][1].samples.distance.diff().iloc[-1]
     # Get final resolution from windowing method
     final_resolution = window - (window * overlap) / 100
     # NB detect_ground is at measured height, detect_surface is between measured heights
     # This still ignores first half layer i.e. surface is put at first measurement within snow
     nlayers = int(shortest_length / depth_step)
     final_nlayers = int(shortest_length / final_resolution)
-    # Create pandas dataframe with depths - will add force for each profile later
-    df = pd.DataFrame(np.arange(final_nlayers) * final_resolution, columns=['distance'])
-    
-    # Add cropped profile calculated median force and structural element length to dataframe
-    for p in list_of_filenames:
-        # Crop to surface NB original distance retained i.e. doesn't start at zero but think this is ok
-        cropped_samples = profile.Profile(p).samples[profile.Profile(p).samples.distance > profile.Profile(p).detect_surface()][:nlayers]
-        # force = profile.Profile(p).samples[profile.Profile(p).samples.distance > profile.Profile(p).detect_surface()]['force'].to_numpy(copy=True)[:nlayers]
-        # Try to run loewe2012 calc
-        profile_fandL = snowmicropyn.loewe2012.calc(cropped_samples, window, overlap)
-        # Add to dataframe: column name is profile name followed by parameter of interest
-        df[p+'_F'] = profile_fandL.force_median.values
-        df[p+'_L'] = profile_fandL.L2012_L.values
-
-        
-    # Find median of forces
-    df['force_median'] = df.loc[:,df.columns.str.endswith('pnt_F')].median(axis=1).to_numpy(copy=True)
-    # Median of structural element length
-    df['L2012_L'] = df.loc[:,df.columns.str.endswith('pnt_L')].median(axis=1).to_numpy(copy=True)
-    # Add to df - keep all in local df for error checking
-    #df['force'] = median_force
-    
-    return df #df[['distance', 'force']]
+    # One column per profile for median force (F) and structural element length (L).
+    # Profiles yielding fewer windows than final_nlayers are padded with NaN.
+    F = np.full((final_nlayers, len(profiles)), np.nan)
+    L = np.full_like(F, np.nan)
+
+    # Calculate median force and structural element length of cropped
+    # profiles. Profiles are independent, so do it concurrently.
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(_cropped_loewe2012, pr, surface, nlayers, window, overlap)
+                   for _, pr, surface, _ in profiles]
+        for i, future in enumerate(futures):
+            profile_fandL = future.result()
+            n = min(final_nlayers, len(profile_fandL))
+            F[:n, i] = profile_fandL.force_median.values[:n]
+            L[:n, i] = profile_fandL.L2012_L.values[:n]
+
+    # Find median of forces and median of structural element length, ignoring NaN
+    return pd.DataFrame({'distance': np.arange(final_nlayers) * final_resolution,
+                         'force_median': np.nanmedian(F, axis=1),
+                         'L2012_L': np.nanmedian(L, axis=1)},
+                        columns=['distance', 'force_median', 'L2012_L'], copy=False)
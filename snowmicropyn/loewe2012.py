@@ -83,10 +83,13 @@ def calc(samples, window=DEFAULT_WINDOW, overlap=DEFAULT_WINDOW_OVERLAP):
 
     # Split dataframe into chunks
     chunks = chunkup(samples, window, overlap)
-    result = []
-    for center, chunk in chunks:
-        f_median = np.median(chunk.force)
-        sn = calc_step(spatial_res, chunk.force)
-        result.append((center, f_median) + sn)
-    return pd.DataFrame(result, columns=['distance', 'force_median', 'L2012_lambda', 'L2012_f0',
-                                         'L2012_delta', 'L2012_L'])
+
+    # Preallocate result, one row per chunk
+    columns = ['distance', 'force_median', 'L2012_lambda', 'L2012_f0', 'L2012_delta', 'L2012_L']
+    result = np.empty((len(chunks), len(columns)))
+    for i, (center, chunk) in enumerate(chunks):
+        force = chunk.force.values
+        result[i, 0] = center
+        result[i, 1] = np.median(force)
+        result[i, 2:] = calc_step(spatial_res, force)
+    return pd.DataFrame(result, columns=columns)
@@ -10,7 +10,7 @@ Geophysical Research: Earth Surface
 Issue 2, February 2015.
 """
 
-from pandas import np as np
+import numpy as np
 import pandas as pd
 
 import snowmicropyn.loewe2012
@@ -22,27 +22,30 @@ DENSITY_ICE = 917.
 def calc_step(median_force, element_size):
     """Calculation of density and ssa from median of force and element size.
 
-    This is the actual math described in the publication.
+    This is the actual math described in the publication. Works on scalars as
+    well as on numpy arrays.
 
-    :param median_force: Median of force.
-    :param element_size: Element size.
-    :return: Tuple containing density and ssa value.
+    :param median_force: Median of force (scalar or numpy array).
+    :param element_size: Element size (scalar or numpy array).
+    :return: Tuple containing density and ssa value(s).
     """
     l = element_size
     fm = median_force
+    log_fm = np.log(fm)
 
     # Equation 9 in publication
     a1 = 420.47
     a2 = 102.47
     a3 = -121.15
     a4 = -169.96
-    density = a1 + a2 * np.log(fm) + a3 * np.log(fm) * l + a4 * l
+    # Factored form of a1 + a2 * log(fm) + a3 * log(fm) * l + a4 * l
+    density = a1 + a4 * l + log_fm * (a2 + a3 * l)
 
     # Equation 11 in publication
     c1 = 0.131
     c2 = 0.355
     c3 = 0.0291
-    lc = c1 + c2 * l + c3 * np.log(fm)
+    lc = c1 + c2 * l + c3 * log_fm
 
     # Equation 12 in publication
     ssa = 4 * (1 - (density / DENSITY_ICE)) / lc
@@ -57,11 +60,10 @@ def calc_from_loewe2012(shotnoise_dataframe):
     :param shotnoise_dataframe: A pandas dataframe containing shot noise model values.
     :return: A pandas dataframe with the columns 'distance', 'P2015_density' and 'P2015_ssa'.
     """
-    result = []
-    for index, row in shotnoise_dataframe.iterrows():
-        density, ssa = calc_step(row.force_median, row.L2012_L)
-        result.append((row.distance, density, ssa))
-    return pd.DataFrame(result, columns=['distance', 'P2015_density', 'P2015_ssa'])
+    sn = shotnoise_dataframe
+    density, ssa = calc_step(sn.force_median.to_numpy(), sn.L2012_L.to_numpy())
+    return pd.DataFrame({'distance': sn.distance.to_numpy(copy=True), 'P2015_density': density, 'P2015_ssa': ssa},
+                        columns=['distance', 'P2015_density', 'P2015_ssa'], copy=False)
 
 
 def calc(samples, window=snowmicropyn.windowing.DEFAULT_WINDOW, overlap=snowmicropyn.windowing.DEFAULT_WINDOW_OVERLAP):
@@ -74,8 +76,4 @@ def calc(samples, window=snowmicropyn.windowing.DEFAULT_WINDOW, overlap=snowmicr
     :return: A pandas dataframe with the columns 'distance', 'P2015_density' and 'P2015_ssa'.
     """
     sn = snowmicropyn.loewe2012.calc(samples, window, overlap)
-    result = []
-    for index, row in sn.iterrows():
-        density, ssa = calc_step(row.force_median, row.L2012_L)
-        result.append((row.distance, density, ssa))
-    return pd.DataFrame(result, columns=['distance', 'P2015_density', 'P2015_ssa'])
+    return calc_from_loewe2012(sn)